@@ -2,21 +2,32 @@ from analysis import Disorder
 from analysis import SymptomMetadata
 from dataclasses import dataclass
 from dataclasses import field
+from flask import Blueprint
 from flask import Flask
 from flask import jsonify
 from flask import request
 from flask.wrappers import Request
+from flask.wrappers import Response
 from flask_cors import CORS
+from profiling import StageTimer
 from typing import Any
 from typing import Dict
 from typing import List
+from typing import Optional
 from typing import Tuple
 from typing import cast
 from werkzeug.exceptions import BadRequest
+from werkzeug.exceptions import Forbidden
+from werkzeug.exceptions import NotFound
 from werkzeug.exceptions import ServiceUnavailable
 
 
 import analysis
+import hmac
+import json
+import os
+import profiling
+import threading
 import traceback
 
 
@@ -36,55 +47,81 @@ class DisorderProbs:
 
 
 app = Flask(__name__)
-CORS(app)
+# The admin routes must not be readable cross-origin, so CORS only covers the public routes.
+CORS(
+    app,
+    resources={
+        r"/disorderCandidates": {"expose_headers": [profiling.PROFILE_ID_HEADER]},
+        r"/symptomNames": {},
+    },
+)
+admin: Blueprint = Blueprint("admin", __name__, url_prefix="/admin")
 app_state: AppState = AppState()
 
+# If set, the /admin routes are registered and require this value in ADMIN_TOKEN_HEADER,
+# and requests carrying it may ask to be profiled.
+ADMIN_TOKEN: Optional[str] = os.environ.get("ADMIN_TOKEN") or None
+ADMIN_TOKEN_HEADER: str = "X-Admin-Token"
+# Set to '0' to run the dev server without the reloader and debugger, e.g. for load tests.
+DEBUG: bool = os.environ.get("FLASK_DEBUG", "1") != "0"
+DISORDER_SYMPTOMS_PATH: str = os.environ.get(
+    "DISORDER_SYMPTOMS_PATH", "../../disorder-symptoms.xml"
+)
 NUM_DISORDER_CANDIDATES: int = 200000
+PORT: int = int(os.environ.get("PORT", "5000"))
+# If set, each request's symptoms are appended here as a JSON line for replay by load_test.py.
+QUERY_LOG_PATH: Optional[str] = os.environ.get("QUERY_LOG_PATH")
 SYMPTOMS_KEY: str = "symptoms"
 
+_query_log_lock: threading.Lock = threading.Lock()
+
+
+@app.before_request
+def track_request_started():
+    profiling.request_started()
+
+
+@app.teardown_request
+def track_request_finished(exception: Optional[BaseException]):
+    profiling.request_finished()
+
 
 @app.route("/disorderCandidates", methods=["POST"])
 def get_disorder_candidates():
     global app_state
 
-    request_data: Dict[str, Any] = _validate_symptom_list(request)
-    symptom_names: List[str] = cast(List[str], request_data.get(SYMPTOMS_KEY))
-    print(f"Symptoms: '{symptom_names}'")
-    try:
-        disorder_candidates: List[
-            Tuple[Disorder, float, float]
-        ] = analysis.compute_p_disorders_conditioned_on_symptoms(
-            app_state.disorders, app_state.symptom_name_to_metadata, symptom_names
+    timer: StageTimer = StageTimer()
+    with profiling.maybe_profile(
+        ADMIN_TOKEN is not None and profiling.should_profile(_profile_requested(request))
+    ) as profile_session:
+        response: Response
+        symptom_names: List[str]
+        num_candidates: int
+        response, symptom_names, num_candidates = _build_disorder_candidates_response(
+            request, timer
         )
-    except Exception as e:
-        stack_trace: str = "\n".join(
-            traceback.format_exception(type(e), e, e.__traceback__)
-        )
-        print(f"ERROR: 500 error raised!\nStacktrace:\n{stack_trace}", flush=True)
-        raise ServiceUnavailable(
-            f"ERROR: Unexpected error occurred while processing symptoms: '{symptom_names}'",
-        )
-    print(
-        f"Limiting '{len(disorder_candidates)}' down to: '{NUM_DISORDER_CANDIDATES}'....."
-    )
-    disorder_candidates = disorder_candidates[:NUM_DISORDER_CANDIDATES]
-    disorder_names_with_probs: List[DisorderProbs] = list(
-        map(
-            lambda x: DisorderProbs(
-                associatedSymptoms=[
-                    symptom_name
-                    for symptom_name in symptom_names
-                    if symptom_name.lower() in x[0].symptom_name_to_symptom
-                ],
-                name=x[0].name,
-                pDisorderLow=round(x[1], 8),
-                pDisorderHigh=round(x[2], 8),
-            ),
-            disorder_candidates,
+    total_ms: float = timer.total_ms()
+    if ADMIN_TOKEN is None:
+        return response
+
+    profile_id: Optional[str] = None
+    if profile_session is not None:
+        profile_id = profiling.new_profile_id()
+        response.headers[profiling.PROFILE_ID_HEADER] = profile_id
+
+    # Store the profile and slow query once the response has been sent, so that
+    # the disk writes are neither counted in total_ms nor delay the client.
+    def store():
+        if profile_session is not None:
+            profiling.store_profile(
+                profile_session, cast(str, profile_id), symptom_names, total_ms
+            )
+        profiling.record_if_slow(
+            symptom_names, num_candidates, timer, total_ms, profile_id
         )
-    )
-    # print(f"Returning: '{disorder_names_with_probs}'")
-    return jsonify({"disorders": disorder_names_with_probs})
+
+    response.call_on_close(store)
+    return response
 
 
 @app.route("/symptomNames", methods=["GET"])
@@ -93,11 +130,112 @@ def get_symptom_names():
     return jsonify({"symptoms": app_state.sympotom_names})
 
 
+@admin.before_request
+def check_admin_token():
+    if not _has_admin_token(request):
+        raise Forbidden(f"ERROR: Expected a valid '{ADMIN_TOKEN_HEADER}' header.")
+
+
+@admin.route("/slowQueries", methods=["GET"])
+def get_slow_queries():
+    return jsonify(
+        {
+            "thresholdMs": profiling.SLOW_QUERY_THRESHOLD_MS,
+            "slowQueries": profiling.get_slow_queries(),
+        }
+    )
+
+
+@admin.route("/profiles", methods=["GET"])
+def get_profiles():
+    return jsonify({"profiles": profiling.get_profiles()})
+
+
+@admin.route("/profiles/<profile_id>", methods=["GET"])
+def get_profile(profile_id: str):
+    profile_summary: Optional[str] = profiling.get_profile_summary(profile_id)
+    if profile_summary is None:
+        raise NotFound(f"ERROR: No stored profile with id: '{profile_id}'")
+    return Response(profile_summary, mimetype="text/plain")
+
+
+if ADMIN_TOKEN is not None:
+    app.register_blueprint(admin)
+
+
+def _build_disorder_candidates_response(
+    request: Request, timer: StageTimer
+) -> Tuple[Response, List[str], int]:
+    with timer.stage("validate"):
+        request_data: Dict[str, Any] = _validate_symptom_list(request)
+    symptom_names: List[str] = cast(List[str], request_data.get(SYMPTOMS_KEY))
+    print(f"Symptoms: '{symptom_names}'")
+    if QUERY_LOG_PATH is not None:
+        _log_query(symptom_names)
+    disorder_candidates: List[Tuple[Disorder, float, float]]
+    disorder_names_with_probs: List[DisorderProbs]
+    disorder_candidates, disorder_names_with_probs = _compute_disorder_candidates(
+        symptom_names, timer
+    )
+    # print(f"Returning: '{disorder_names_with_probs}'")
+    with timer.stage("serialize"):
+        response: Response = jsonify({"disorders": disorder_names_with_probs})
+    return response, symptom_names, len(disorder_candidates)
+
+
+def _compute_disorder_candidates(
+    symptom_names: List[str], timer: StageTimer
+) -> Tuple[List[Tuple[Disorder, float, float]], List[DisorderProbs]]:
+    with timer.stage("score"):
+        try:
+            disorder_candidates: List[
+                Tuple[Disorder, float, float]
+            ] = analysis.compute_p_disorders_conditioned_on_symptoms(
+                app_state.disorders, app_state.symptom_name_to_metadata, symptom_names
+            )
+        except Exception as e:
+            stack_trace: str = "\n".join(
+                traceback.format_exception(type(e), e, e.__traceback__)
+            )
+            print(f"ERROR: 500 error raised!\nStacktrace:\n{stack_trace}", flush=True)
+            raise ServiceUnavailable(
+                f"ERROR: Unexpected error occurred while processing symptoms: '{symptom_names}'",
+            )
+    print(
+        f"Limiting '{len(disorder_candidates)}' down to: '{NUM_DISORDER_CANDIDATES}'....."
+    )
+    with timer.stage("format"):
+        disorder_names_with_probs: List[DisorderProbs] = list(
+            map(
+                lambda x: DisorderProbs(
+                    associatedSymptoms=[
+                        symptom_name
+                        for symptom_name in symptom_names
+                        if symptom_name.lower() in x[0].symptom_name_to_symptom
+                    ],
+                    name=x[0].name,
+                    pDisorderLow=round(x[1], 8),
+                    pDisorderHigh=round(x[2], 8),
+                ),
+                disorder_candidates[:NUM_DISORDER_CANDIDATES],
+            )
+        )
+    return disorder_candidates, disorder_names_with_probs
+
+
+def create_app() -> Flask:
+    """
+    Entry point for WSGI servers, e.g.: gunicorn 'backend:create_app()'
+    """
+    init()
+    return app
+
+
 def init():
     global app_state
 
     print(f"Loading disorders and symptoms into app state.....")
-    app_state.disorders = analysis.read_file("../../disorder-symptoms.xml")
+    app_state.disorders = analysis.read_file(DISORDER_SYMPTOMS_PATH)
     app_state.symptom_name_to_metadata = analysis.compute_symptom_metadata(
         app_state.disorders
     )
@@ -117,6 +255,24 @@ def init():
     )
 
 
+def _has_admin_token(request: Request) -> bool:
+    return ADMIN_TOKEN is not None and hmac.compare_digest(
+        request.headers.get(ADMIN_TOKEN_HEADER, "").encode(), ADMIN_TOKEN.encode()
+    )
+
+
+def _profile_requested(request: Request) -> bool:
+    return _has_admin_token(request) and request.headers.get(
+        profiling.PROFILE_HEADER, ""
+    ).strip().lower() in ("1", "true", "yes")
+
+
+def _log_query(symptom_names: List[str]):
+    with _query_log_lock:
+        with open(cast(str, QUERY_LOG_PATH), "a") as query_log_file:
+            query_log_file.write(json.dumps({SYMPTOMS_KEY: symptom_names}) + "\n")
+
+
 def _validate_symptom_list(request: Request) -> Dict[str, Any]:
     request_data: Dict[str, Any] = request.get_json()
     if SYMPTOMS_KEY not in request_data:
@@ -149,4 +305,4 @@ def _validate_symptom_list(request: Request) -> Dict[str, Any]:
 
 if __name__ == "__main__":
     init()
-    app.run(debug=True)
+    app.run(debug=DEBUG, port=PORT)
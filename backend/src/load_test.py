@@ -0,0 +1,676 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from typing import cast
+
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import synthetic_data
+
+
+DISORDER_CANDIDATES_ENDPOINT: str = "/disorderCandidates"
+SYMPTOM_NAMES_ENDPOINT: str = "/symptomNames"
+SERVER_MODES: List[str] = ["dev", "prefork", "threaded", "external"]
+SERVER_STARTUP_TIMEOUT_S: float = 300.0
+REQUEST_TIMEOUT_S: float = 60.0
+NUM_GENERATED_QUERIES: int = 1000
+PERCENTILES: List[float] = [50.0, 90.0, 99.0]
+
+
+@dataclass
+class RequestResult:
+    endpoint: str
+    end_offset_s: float
+    latency_ms: float
+    status: int
+    error: Optional[str] = None
+
+
+@dataclass
+class ResourceSample:
+    start_offset_s: float
+    end_offset_s: float
+    cpu_percent: float
+    rss_mb: float
+    num_processes: int
+
+
+@dataclass
+class IntervalStats:
+    offsetS: float
+    requests: int
+    errors: int
+    latencyMs: Dict[str, float]
+    cpuPercent: Optional[float]
+    rssMb: Optional[float]
+
+
+@dataclass
+class LoadTestReport:
+    mode: str
+    concurrency: int
+    targetRps: float
+    durationS: float
+    totalRequests: int
+    throughputRps: float
+    errorRate: float
+    statusCounts: Dict[str, int]
+    latencyMs: Dict[str, Dict[str, float]]
+    droppedRequests: int = 0
+    intervals: List[IntervalStats] = field(default_factory=list)
+
+
+class ServerProcess:
+    """
+    Runs the backend in one of SERVER_MODES as a child process group, so that
+    the whole process tree (reloader, workers) can be measured and stopped.
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        port: int,
+        dataset_path: str,
+        workers: int,
+        threads: int,
+        log_path: str,
+    ):
+        self.log_path: str = log_path
+        self.mode: str = mode
+        self.port: int = port
+        self.dataset_path: str = dataset_path
+        self.workers: int = workers
+        self.threads: int = threads
+        self.process: Optional[subprocess.Popen] = None
+
+    def command(self) -> List[str]:
+        if self.mode == "dev":
+            return [sys.executable, "backend.py"]
+        gunicorn_command: List[str] = [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "--bind",
+            f"127.0.0.1:{self.port}",
+            "--workers",
+            str(self.workers),
+            "--timeout",
+            str(int(REQUEST_TIMEOUT_S)),
+            # Load the dataset once and fork it into the workers.
+            "--preload",
+        ]
+        if self.mode == "threaded":
+            gunicorn_command += ["--worker-class", "gthread", "--threads", str(self.threads)]
+        return gunicorn_command + ["backend:create_app()"]
+
+    def start(self, base_url: str):
+        # Otherwise the ready check and the load could reach a leftover server from an earlier run.
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+            if probe.connect_ex(("127.0.0.1", self.port)) == 0:
+                raise RuntimeError(
+                    f"ERROR: Port: '{self.port}' is already in use, "
+                    "stop the server listening on it or pass another --port."
+                )
+        env: Dict[str, str] = dict(os.environ)
+        env["DISORDER_SYMPTOMS_PATH"] = os.path.abspath(self.dataset_path)
+        env["PORT"] = str(self.port)
+        # Measure the dev server itself, not the reloader process and debugger middleware.
+        env["FLASK_DEBUG"] = "0"
+        print(
+            f"Starting server in mode: '{self.mode}' with: '{self.command()}' "
+            f"logging to: '{self.log_path}'"
+        )
+        with open(self.log_path, "w") as log_file:
+            self.process = subprocess.Popen(
+                self.command(),
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                env=env,
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+                start_new_session=True,
+            )
+        try:
+            self._wait_until_ready(base_url)
+        except BaseException:
+            # Including KeyboardInterrupt, which the child's separate session never receives.
+            self.stop()
+            raise
+
+    def _wait_until_ready(self, base_url: str):
+        process: subprocess.Popen = cast(subprocess.Popen, self.process)
+        deadline: float = time.monotonic() + SERVER_STARTUP_TIMEOUT_S
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(
+                    f"ERROR: Server exited with code: '{process.returncode}' "
+                    f"before becoming ready, see: '{self.log_path}'"
+                )
+            try:
+                with urllib.request.urlopen(
+                    base_url + SYMPTOM_NAMES_ENDPOINT, timeout=5.0
+                ):
+                    print(f"Server ready at: '{base_url}'")
+                    return
+            except (urllib.error.URLError, ConnectionError, TimeoutError):
+                time.sleep(0.5)
+        raise RuntimeError(
+            f"ERROR: Server was not ready after: '{SERVER_STARTUP_TIMEOUT_S}' seconds."
+        )
+
+    def stop(self):
+        if self.process is None or self.process.poll() is not None:
+            return
+        os.killpg(self.process.pid, signal.SIGTERM)
+        try:
+            self.process.wait(timeout=10.0)
+        except subprocess.TimeoutExpired:
+            os.killpg(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+
+
+class ResourceSampler(threading.Thread):
+    """
+    Periodically sums CPU time and RSS over a process and all of its
+    descendants by reading /proc. Only supported on Linux.
+    """
+
+    def __init__(self, root_pid: int, interval_s: float, start_time: float):
+        super().__init__(daemon=True)
+        self.root_pid: int = root_pid
+        self.interval_s: float = interval_s
+        self.start_time: float = start_time
+        self.samples: List[ResourceSample] = list()
+        self.stop_event: threading.Event = threading.Event()
+        self.clock_ticks: int = os.sysconf("SC_CLK_TCK")
+        self.page_size: int = os.sysconf("SC_PAGE_SIZE")
+        self.last_cpu_s: float = self._read_tree()[0]
+        self.last_offset_s: float = time.monotonic() - self.start_time
+
+    def run(self):
+        next_offset_s: float = self.interval_s
+        # Sample at start_time + k * interval_s, so samples line up with the report's intervals.
+        while not self.stop_event.wait(
+            max(0.0, next_offset_s - (time.monotonic() - self.start_time))
+        ):
+            self._sample()
+            next_offset_s += self.interval_s
+
+    def stop(self):
+        """
+        Stop sampling, taking a final sample that covers the time since the last one.
+        """
+        self.stop_event.set()
+        self.join()
+        self._sample()
+
+    def _sample(self):
+        cpu_s, rss_bytes, num_processes = self._read_tree()
+        offset_s: float = time.monotonic() - self.start_time
+        if offset_s <= self.last_offset_s:
+            return
+        self.samples.append(
+            ResourceSample(
+                start_offset_s=self.last_offset_s,
+                end_offset_s=offset_s,
+                cpu_percent=round(
+                    100.0
+                    * max(0.0, cpu_s - self.last_cpu_s)
+                    / (offset_s - self.last_offset_s),
+                    1,
+                ),
+                rss_mb=round(rss_bytes / (1024.0 * 1024.0), 1),
+                num_processes=num_processes,
+            )
+        )
+        self.last_cpu_s, self.last_offset_s = cpu_s, offset_s
+
+    def _read_tree(self) -> Tuple[float, int, int]:
+        parent_pid_to_pids: Dict[int, List[int]] = dict()
+        pid_to_stat: Dict[int, List[str]] = dict()
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as stat_file:
+                    # The command name may contain spaces, so split after it.
+                    stat: List[str] = stat_file.read().rsplit(")", 1)[1].split()
+            except (FileNotFoundError, ProcessLookupError, IndexError):
+                continue
+            pid_to_stat[int(entry)] = stat
+            parent_pid_to_pids.setdefault(int(stat[1]), list()).append(int(entry))
+
+        tree_pids: Set[int] = set()
+        pids_to_visit: List[int] = [self.root_pid]
+        while len(pids_to_visit) > 0:
+            pid: int = pids_to_visit.pop()
+            if pid in tree_pids or pid not in pid_to_stat:
+                continue
+            tree_pids.add(pid)
+            pids_to_visit.extend(parent_pid_to_pids.get(pid, list()))
+
+        # Fields after the command name: utime and stime are 14 and 15, rss is 24.
+        cpu_ticks: int = sum(
+            int(pid_to_stat[pid][11]) + int(pid_to_stat[pid][12]) for pid in tree_pids
+        )
+        rss_pages: int = sum(int(pid_to_stat[pid][21]) for pid in tree_pids)
+        return (
+            cpu_ticks / float(self.clock_ticks),
+            rss_pages * self.page_size,
+            len(tree_pids),
+        )
+
+
+def fetch_symptom_names(base_url: str) -> List[str]:
+    with urllib.request.urlopen(
+        base_url + SYMPTOM_NAMES_ENDPOINT, timeout=REQUEST_TIMEOUT_S
+    ) as response:
+        return json.loads(response.read())["symptoms"]
+
+
+def generate_queries(
+    symptom_names: List[str], max_symptoms_per_query: int, rng: random.Random
+) -> List[List[str]]:
+    return [
+        rng.sample(
+            symptom_names, rng.randint(1, min(max_symptoms_per_query, len(symptom_names)))
+        )
+        for _ in range(NUM_GENERATED_QUERIES)
+    ]
+
+
+def read_queries(query_log_path: str) -> List[List[str]]:
+    """
+    Read queries recorded by the backend with QUERY_LOG_PATH set, one
+    JSON object with a 'symptoms' list per line.
+    """
+    queries: List[List[str]] = list()
+    with open(query_log_path) as query_log_file:
+        for line in query_log_file:
+            if line.strip():
+                queries.append(json.loads(line)["symptoms"])
+    if len(queries) == 0:
+        raise ValueError(f"ERROR: No queries found in: '{query_log_path}'")
+    return queries
+
+
+def send_request(
+    base_url: str, endpoint: str, body: Optional[Dict[str, Any]]
+) -> Tuple[int, Optional[str]]:
+    data: Optional[bytes] = None if body is None else json.dumps(body).encode()
+    http_request: urllib.request.Request = urllib.request.Request(
+        base_url + endpoint,
+        data=data,
+        headers={"Content-Type": "application/json"},
+        method="GET" if body is None else "POST",
+    )
+    try:
+        with urllib.request.urlopen(http_request, timeout=REQUEST_TIMEOUT_S) as response:
+            response.read()
+            return (response.status, None)
+    except urllib.error.HTTPError as e:
+        return (e.code, None)
+    except Exception as e:
+        return (0, f"{type(e).__name__}: {e}")
+
+
+def run_load(
+    base_url: str,
+    queries: List[List[str]],
+    symptom_names_ratio: float,
+    concurrency: int,
+    rps: float,
+    duration_s: float,
+    start_time: float,
+    rng: random.Random,
+) -> Tuple[List[RequestResult], int]:
+    """
+    With rps > 0 requests are sent open-loop on a fixed schedule and latency is
+    measured from each request's scheduled send time, so that queueing caused
+    by a saturated server is included. Scheduled requests still queued at the
+    end of the run are dropped rather than sent, and counted separately. With
+    rps == 0 each of the concurrency workers sends requests back-to-back
+    (closed loop).
+
+    Returns the results and the number of dropped requests.
+    """
+    results: List[RequestResult] = list()
+    query_index_lock: threading.Lock = threading.Lock()
+    next_query_index: List[int] = [0]
+    num_dropped: List[int] = [0]
+
+    def next_request() -> Tuple[str, Optional[Dict[str, Any]]]:
+        with query_index_lock:
+            if rng.random() < symptom_names_ratio:
+                return (SYMPTOM_NAMES_ENDPOINT, None)
+            query: List[str] = queries[next_query_index[0] % len(queries)]
+            next_query_index[0] += 1
+        return (DISORDER_CANDIDATES_ENDPOINT, {"symptoms": query})
+
+    def fire(scheduled_time: float):
+        if time.monotonic() >= deadline:
+            with query_index_lock:
+                num_dropped[0] += 1
+            return
+        endpoint, body = next_request()
+        status, error = send_request(base_url, endpoint, body)
+        end_time: float = time.monotonic()
+        results.append(
+            RequestResult(
+                endpoint=endpoint,
+                end_offset_s=end_time - start_time,
+                latency_ms=(end_time - scheduled_time) * 1000.0,
+                status=status,
+                error=error,
+            )
+        )
+
+    deadline: float = start_time + duration_s
+    if rps > 0.0:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            scheduled_time: float = start_time
+            while scheduled_time < deadline:
+                time.sleep(max(0.0, scheduled_time - time.monotonic()))
+                executor.submit(fire, scheduled_time)
+                scheduled_time += 1.0 / rps
+    else:
+
+        def worker():
+            while time.monotonic() < deadline:
+                fire(time.monotonic())
+
+        workers: List[threading.Thread] = [
+            threading.Thread(target=worker, daemon=True) for _ in range(concurrency)
+        ]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    return (results, num_dropped[0])
+
+
+def percentiles_ms(latencies_ms: List[float]) -> Dict[str, float]:
+    if len(latencies_ms) == 0:
+        return dict()
+    latencies_ms = sorted(latencies_ms)
+    percentiles: Dict[str, float] = {
+        f"p{int(p)}": round(
+            latencies_ms[max(0, math.ceil(p / 100.0 * len(latencies_ms)) - 1)], 2
+        )
+        for p in PERCENTILES
+    }
+    percentiles["max"] = round(latencies_ms[-1], 2)
+    return percentiles
+
+
+def _is_error(result: RequestResult) -> bool:
+    return result.error is not None or result.status >= 400
+
+
+def build_report(
+    mode: str,
+    concurrency: int,
+    rps: float,
+    elapsed_s: float,
+    results: List[RequestResult],
+    num_dropped: int,
+    resource_samples: List[ResourceSample],
+    interval_s: float,
+) -> LoadTestReport:
+    status_counts: Dict[str, int] = dict()
+    for result in results:
+        status_key: str = "error" if result.error is not None else str(result.status)
+        status_counts[status_key] = status_counts.get(status_key, 0) + 1
+
+    latency_ms: Dict[str, Dict[str, float]] = {
+        "all": percentiles_ms([x.latency_ms for x in results if not _is_error(x)])
+    }
+    for endpoint in (DISORDER_CANDIDATES_ENDPOINT, SYMPTOM_NAMES_ENDPOINT):
+        latency_ms[endpoint] = percentiles_ms(
+            [x.latency_ms for x in results if x.endpoint == endpoint and not _is_error(x)]
+        )
+
+    intervals: List[IntervalStats] = list()
+    for interval_index in range(math.ceil(elapsed_s / interval_s)):
+        interval_start: float = interval_index * interval_s
+        interval_end: float = interval_start + interval_s
+        interval_results: List[RequestResult] = [
+            x for x in results if interval_start <= x.end_offset_s < interval_end
+        ]
+        # Bucket each sample by the midpoint of the time window it covers.
+        interval_samples: List[ResourceSample] = [
+            x
+            for x in resource_samples
+            if interval_start
+            <= (x.start_offset_s + x.end_offset_s) / 2.0
+            < interval_end
+        ]
+        intervals.append(
+            IntervalStats(
+                offsetS=round(interval_start, 1),
+                requests=len(interval_results),
+                errors=len(list(filter(_is_error, interval_results))),
+                latencyMs=percentiles_ms(
+                    [x.latency_ms for x in interval_results if not _is_error(x)]
+                ),
+                cpuPercent=interval_samples[-1].cpu_percent
+                if len(interval_samples) > 0
+                else None,
+                rssMb=interval_samples[-1].rss_mb if len(interval_samples) > 0 else None,
+            )
+        )
+
+    return LoadTestReport(
+        mode=mode,
+        concurrency=concurrency,
+        targetRps=rps,
+        durationS=round(elapsed_s, 2),
+        totalRequests=len(results),
+        throughputRps=round(len(results) / elapsed_s, 2) if elapsed_s > 0.0 else 0.0,
+        errorRate=round(len(list(filter(_is_error, results))) / len(results), 4)
+        if len(results) > 0
+        else 0.0,
+        statusCounts=status_counts,
+        latencyMs=latency_ms,
+        droppedRequests=num_dropped,
+        intervals=intervals,
+    )
+
+
+def print_report(report: LoadTestReport):
+    print(
+        f"\nMode: '{report.mode}' concurrency: '{report.concurrency}' "
+        f"target rps: '{report.targetRps or 'unbounded'}'"
+    )
+    print(
+        f"Requests: '{report.totalRequests}' in '{report.durationS}' s, "
+        f"throughput: '{report.throughputRps}' rps, error rate: '{report.errorRate}'"
+    )
+    print(f"Status counts: '{report.statusCounts}'")
+    if report.droppedRequests > 0:
+        print(
+            f"Dropped: '{report.droppedRequests}' scheduled requests that were still "
+            "queued at the end of the run, the server could not keep up with the target rps."
+        )
+    for endpoint, percentiles in report.latencyMs.items():
+        print(f"Latency ms {endpoint}: '{percentiles}'")
+    print(f"\n{'t (s)':>8}{'reqs':>8}{'errs':>8}{'p50':>10}{'p99':>10}{'cpu %':>8}{'rss MB':>10}")
+    for interval in report.intervals:
+        print(
+            f"{interval.offsetS:>8}{interval.requests:>8}{interval.errors:>8}"
+            f"{interval.latencyMs.get('p50', '-'):>10}{interval.latencyMs.get('p99', '-'):>10}"
+            f"{interval.cpuPercent if interval.cpuPercent is not None else '-':>8}"
+            f"{interval.rssMb if interval.rssMb is not None else '-':>10}"
+        )
+
+
+def non_negative_float(value: str) -> float:
+    parsed: float = float(value)
+    if not (math.isfinite(parsed) and parsed >= 0.0):
+        raise argparse.ArgumentTypeError(
+            f"Expected a finite value >= 0, but was: '{value}'"
+        )
+    return parsed
+
+
+def positive_float(value: str) -> float:
+    parsed: float = float(value)
+    if not (math.isfinite(parsed) and parsed > 0.0):
+        raise argparse.ArgumentTypeError(
+            f"Expected a finite value > 0, but was: '{value}'"
+        )
+    return parsed
+
+
+def positive_int(value: str) -> int:
+    parsed: int = int(value)
+    if parsed <= 0:
+        raise argparse.ArgumentTypeError(f"Expected a value > 0, but was: '{value}'")
+    return parsed
+
+
+def main(args: argparse.Namespace):
+    if args.mode == "external" and args.url is None:
+        raise ValueError("ERROR: Mode: 'external' requires --url.")
+    if args.mode != "external" and args.url is not None:
+        raise ValueError(
+            f"ERROR: --url is only used with mode: 'external', but mode was: '{args.mode}'. "
+            "The server is started on --port instead."
+        )
+    work_dir: Optional[str] = (
+        None if args.mode == "external" else tempfile.mkdtemp(prefix="load-test-")
+    )
+    try:
+        report: LoadTestReport = run_load_test(args, work_dir)
+    except BaseException:
+        if work_dir is not None:
+            print(f"Kept dataset and server log for debugging in: '{work_dir}'")
+        raise
+    if work_dir is not None:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(report)
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(asdict(report), output_file, indent=2)
+        print(f"\nWrote report to: '{args.output}'")
+
+
+def run_load_test(args: argparse.Namespace, work_dir: Optional[str]) -> LoadTestReport:
+    rng: random.Random = random.Random(args.seed)
+    base_url: str = args.url or f"http://127.0.0.1:{args.port}"
+    server: Optional[ServerProcess] = None
+    if work_dir is not None:
+        dataset_path: str = args.dataset
+        if dataset_path is None:
+            dataset_path = os.path.join(work_dir, "synthetic-disorder-symptoms.xml")
+            synthetic_data.generate_disorder_symptoms_xml(
+                dataset_path,
+                args.synthetic_num_disorders,
+                args.synthetic_num_symptoms,
+                args.synthetic_max_symptoms_per_disorder,
+                args.seed,
+            )
+        server = ServerProcess(
+            args.mode,
+            args.port,
+            dataset_path,
+            args.workers,
+            args.threads,
+            os.path.join(work_dir, "server.log"),
+        )
+
+    sampler: Optional[ResourceSampler] = None
+    try:
+        if server is not None:
+            server.start(base_url)
+        queries: List[List[str]] = (
+            read_queries(args.queries)
+            if args.queries is not None
+            else generate_queries(
+                fetch_symptom_names(base_url), args.max_symptoms_per_query, rng
+            )
+        )
+        print(f"Replaying '{len(queries)}' queries for '{args.duration}' s.....")
+        start_time: float = time.monotonic()
+        if server is not None and server.process is not None and sys.platform == "linux":
+            sampler = ResourceSampler(server.process.pid, args.interval, start_time)
+            sampler.start()
+        results: List[RequestResult]
+        num_dropped: int
+        results, num_dropped = run_load(
+            base_url,
+            queries,
+            args.symptom_names_ratio,
+            args.concurrency,
+            args.rps,
+            args.duration,
+            start_time,
+            rng,
+        )
+        elapsed_s: float = time.monotonic() - start_time
+        if sampler is not None:
+            sampler.stop()
+    finally:
+        if server is not None:
+            server.stop()
+
+    return build_report(
+        args.mode,
+        args.concurrency,
+        args.rps,
+        elapsed_s,
+        results,
+        num_dropped,
+        sampler.samples if sampler is not None else list(),
+        args.interval,
+    )
+
+
+if __name__ == "__main__":
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description="Start the backend locally and replay a query mix against it."
+    )
+    parser.add_argument("--mode", choices=SERVER_MODES, default="dev")
+    parser.add_argument("--url", help="Base url of an already running server.")
+    parser.add_argument("--port", type=int, default=5050)
+    parser.add_argument("--workers", type=positive_int, default=4)
+    parser.add_argument("--threads", type=positive_int, default=4)
+    parser.add_argument(
+        "--dataset", help="Snapshot XML dataset. A synthetic one is generated if unset."
+    )
+    parser.add_argument("--synthetic-num-disorders", type=int, default=4000)
+    parser.add_argument("--synthetic-num-symptoms", type=int, default=8000)
+    parser.add_argument("--synthetic-max-symptoms-per-disorder", type=int, default=60)
+    parser.add_argument(
+        "--queries", help="Query log recorded with QUERY_LOG_PATH. Generated if unset."
+    )
+    parser.add_argument("--max-symptoms-per-query", type=positive_int, default=5)
+    parser.add_argument("--symptom-names-ratio", type=float, default=0.1)
+    parser.add_argument("--concurrency", type=positive_int, default=8)
+    parser.add_argument("--rps", type=non_negative_float, default=0.0, help="0 for closed loop.")
+    parser.add_argument("--duration", type=positive_float, default=30.0)
+    parser.add_argument("--interval", type=positive_float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report as JSON to this path.")
+    main(parser.parse_args())
@@ -0,0 +1,341 @@
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Any
+from typing import Deque
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+import cProfile
+import fcntl
+import io
+import json
+import os
+import pstats
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+
+PROFILE_HEADER: str = "X-Profile-Request"
+PROFILE_ID_HEADER: str = "X-Profile-Id"
+PROFILE_SAMPLE_RATE: float = float(os.environ.get("PROFILE_SAMPLE_RATE", "0.0"))
+# Profiles and slow queries are stored on disk, so that every worker process
+# of a prefork server sees the same profiles and slow queries.
+PROFILE_DIR: str = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_ID_PATTERN: re.Pattern = re.compile(r"^[0-9a-f]{32}$")
+PROFILE_RING_BUFFER_SIZE: int = 50
+PROFILE_SUMMARY_NUM_LINES: int = 40
+SLOW_QUERY_LOG_FILE_NAME: str = "slow_queries.jsonl"
+SLOW_QUERY_LOG_MAX_BYTES: int = 1024 * 1024
+SLOW_QUERY_THRESHOLD_MS: float = float(
+    os.environ.get("SLOW_QUERY_THRESHOLD_MS", "500.0")
+)
+SLOW_QUERY_RING_BUFFER_SIZE: int = 100
+
+
+@dataclass
+class ProfileRecord:
+    id: str
+    # cProfile sees every thread, so on a threaded server the profile also
+    # includes the work of this many other requests.
+    otherRequestsInFlight: int
+    symptoms: List[str]
+    timestamp: float
+    totalMs: float
+
+
+@dataclass
+class SlowQuery:
+    numCandidates: int
+    profileId: Optional[str]
+    stageTimingsMs: Dict[str, float]
+    symptoms: List[str]
+    timestamp: float
+    totalMs: float
+
+
+@dataclass
+class StageTimer:
+    """
+    Records wall-clock time spent in each named stage of a request,
+    in the order that the stages were run.
+    """
+
+    start: float = field(default_factory=time.perf_counter)
+    stage_timings_ms: Dict[str, float] = field(default_factory=dict)
+
+    @contextmanager
+    def stage(self, stage_name: str) -> Iterator[None]:
+        stage_start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_timings_ms[stage_name] = round(
+                (time.perf_counter() - stage_start) * 1000.0, 3
+            )
+
+    def total_ms(self) -> float:
+        return round((time.perf_counter() - self.start) * 1000.0, 3)
+
+
+@dataclass
+class ProfileSession:
+    profiler: cProfile.Profile
+    peak_requests_in_flight: int
+
+
+# Only one profiler can be active per interpreter, so concurrent requests that
+# ask to be profiled while another is being profiled are run unprofiled.
+_profiler_lock: threading.Lock = threading.Lock()
+_in_flight_lock: threading.Lock = threading.Lock()
+_requests_in_flight: int = 0
+_active_session: Optional[ProfileSession] = None
+
+
+def request_started():
+    global _requests_in_flight
+    with _in_flight_lock:
+        _requests_in_flight += 1
+        if _active_session is not None:
+            _active_session.peak_requests_in_flight = max(
+                _active_session.peak_requests_in_flight, _requests_in_flight
+            )
+
+
+def request_finished():
+    global _requests_in_flight
+    with _in_flight_lock:
+        _requests_in_flight -= 1
+
+
+def should_profile(profile_requested: bool) -> bool:
+    """
+    A request is profiled when it asked to be, or when it is picked by
+    sampling at PROFILE_SAMPLE_RATE.
+    """
+    if profile_requested:
+        return True
+    return PROFILE_SAMPLE_RATE > 0.0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+@contextmanager
+def maybe_profile(enabled: bool) -> Iterator[Optional[ProfileSession]]:
+    """
+    Run the body under cProfile if enabled and no other request is currently
+    being profiled. Yields the profile session, or None if the body ran
+    unprofiled.
+    """
+    global _active_session
+    if not enabled or not _profiler_lock.acquire(blocking=False):
+        yield None
+        return
+    try:
+        with _in_flight_lock:
+            session: ProfileSession = ProfileSession(
+                profiler=cProfile.Profile(),
+                peak_requests_in_flight=max(1, _requests_in_flight),
+            )
+            _active_session = session
+        session.profiler.enable()
+        try:
+            yield session
+        finally:
+            session.profiler.disable()
+            with _in_flight_lock:
+                _active_session = None
+    finally:
+        _profiler_lock.release()
+
+
+def new_profile_id() -> str:
+    return uuid.uuid4().hex
+
+
+def store_profile(
+    session: ProfileSession,
+    profile_id: str,
+    symptom_names: List[str],
+    total_ms: float,
+) -> ProfileRecord:
+    """
+    Write the profile to PROFILE_DIR as '<id>.prof' alongside its metadata in
+    '<id>.json', then delete the oldest profiles beyond PROFILE_RING_BUFFER_SIZE.
+
+    Both files are written to a temporary file and renamed into place, so
+    other workers never read a partially written profile.
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile_record: ProfileRecord = ProfileRecord(
+        id=profile_id,
+        otherRequestsInFlight=session.peak_requests_in_flight - 1,
+        symptoms=list(symptom_names),
+        timestamp=time.time(),
+        totalMs=total_ms,
+    )
+    with _temp_file_path() as temp_path:
+        with open(temp_path, "w") as profile_record_file:
+            json.dump(asdict(profile_record), profile_record_file)
+        os.replace(temp_path, _profile_record_path(profile_id))
+    with _temp_file_path() as temp_path:
+        session.profiler.dump_stats(temp_path)
+        os.replace(temp_path, _profile_path(profile_id))
+    for evicted_profile_id in _list_profile_ids()[PROFILE_RING_BUFFER_SIZE:]:
+        for path in (
+            _profile_path(evicted_profile_id),
+            _profile_record_path(evicted_profile_id),
+        ):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Already evicted by another worker.
+                pass
+    print(f"Stored profile: '{profile_id}' for symptoms: '{symptom_names}'")
+    return profile_record
+
+
+def record_if_slow(
+    symptom_names: List[str],
+    num_candidates: int,
+    timer: StageTimer,
+    total_ms: float,
+    profile_id: Optional[str],
+) -> Optional[SlowQuery]:
+    if total_ms < SLOW_QUERY_THRESHOLD_MS:
+        return None
+    slow_query: SlowQuery = SlowQuery(
+        numCandidates=num_candidates,
+        profileId=profile_id,
+        stageTimingsMs=dict(timer.stage_timings_ms),
+        symptoms=list(symptom_names),
+        timestamp=time.time(),
+        totalMs=total_ms,
+    )
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    slow_query_log_path: str = os.path.join(PROFILE_DIR, SLOW_QUERY_LOG_FILE_NAME)
+    with open(slow_query_log_path, "a") as slow_query_log_file:
+        # Hold an exclusive lock while appending and rotating, so that two workers
+        # crossing SLOW_QUERY_LOG_MAX_BYTES together only rotate the log once.
+        fcntl.flock(slow_query_log_file, fcntl.LOCK_EX)
+        slow_query_log_file.write(json.dumps(asdict(slow_query)) + "\n")
+        slow_query_log_file.flush()
+        log_stat: os.stat_result = os.fstat(slow_query_log_file.fileno())
+        try:
+            path_stat: Optional[os.stat_result] = os.stat(slow_query_log_path)
+        except FileNotFoundError:
+            path_stat = None
+        # Skip rotating if another worker already rotated the file this line was appended to.
+        if (
+            log_stat.st_size > SLOW_QUERY_LOG_MAX_BYTES
+            and path_stat is not None
+            and path_stat.st_ino == log_stat.st_ino
+        ):
+            # Keep the log bounded by rotating it into a single previous generation.
+            os.replace(slow_query_log_path, slow_query_log_path + ".1")
+    print(
+        f"Slow query: '{total_ms}' ms >= '{SLOW_QUERY_THRESHOLD_MS}' ms "
+        f"for symptoms: '{symptom_names}' stages: '{slow_query.stageTimingsMs}'"
+    )
+    return slow_query
+
+
+def get_profiles() -> List[ProfileRecord]:
+    profile_records: List[ProfileRecord] = list()
+    for profile_id in _list_profile_ids()[:PROFILE_RING_BUFFER_SIZE]:
+        try:
+            with open(_profile_record_path(profile_id)) as profile_record_file:
+                profile_records.append(ProfileRecord(**json.load(profile_record_file)))
+        except (FileNotFoundError, ValueError):
+            # Evicted, or still being written by another worker.
+            continue
+    return profile_records
+
+
+def get_profile_summary(profile_id: str) -> Optional[str]:
+    """
+    Render the stored profile with the given id as pstats text, sorted by
+    cumulative time. Returns None if the profile is unknown or was evicted.
+    """
+    if PROFILE_ID_PATTERN.match(profile_id) is None:
+        return None
+    stream: io.StringIO = io.StringIO()
+    try:
+        pstats.Stats(_profile_path(profile_id), stream=stream).sort_stats(
+            pstats.SortKey.CUMULATIVE
+        ).print_stats(PROFILE_SUMMARY_NUM_LINES)
+    except (FileNotFoundError, EOFError, TypeError, ValueError):
+        # Unknown, evicted, or not a readable profile.
+        return None
+    return stream.getvalue()
+
+
+def get_slow_queries() -> List[SlowQuery]:
+    slow_query_log_path: str = os.path.join(PROFILE_DIR, SLOW_QUERY_LOG_FILE_NAME)
+    slow_queries: Deque[SlowQuery] = deque(maxlen=SLOW_QUERY_RING_BUFFER_SIZE)
+    for path in (slow_query_log_path + ".1", slow_query_log_path):
+        try:
+            with open(path) as slow_query_log_file:
+                for line in slow_query_log_file:
+                    try:
+                        slow_query_fields: Dict[str, Any] = json.loads(line)
+                    except ValueError:
+                        # Partially written line.
+                        continue
+                    slow_queries.append(SlowQuery(**slow_query_fields))
+        except FileNotFoundError:
+            continue
+    return list(reversed(slow_queries))
+
+
+def _list_profile_ids() -> List[str]:
+    """
+    Ids of the profiles stored in PROFILE_DIR, newest first.
+    """
+    try:
+        entries: List[os.DirEntry] = list(os.scandir(PROFILE_DIR))
+    except FileNotFoundError:
+        return list()
+    profile_id_to_mtime: Dict[str, float] = dict()
+    for entry in entries:
+        profile_id, extension = os.path.splitext(entry.name)
+        if extension != ".prof" or PROFILE_ID_PATTERN.match(profile_id) is None:
+            continue
+        try:
+            profile_id_to_mtime[profile_id] = entry.stat().st_mtime
+        except FileNotFoundError:
+            continue
+    return sorted(
+        profile_id_to_mtime, key=lambda x: profile_id_to_mtime[x], reverse=True
+    )
+
+
+@contextmanager
+def _temp_file_path() -> Iterator[str]:
+    """
+    Yield the path of a new temporary file in PROFILE_DIR, removing it
+    afterwards unless it was renamed away.
+    """
+    temp_fd, temp_path = tempfile.mkstemp(dir=PROFILE_DIR, suffix=".tmp")
+    os.close(temp_fd)
+    try:
+        yield temp_path
+    finally:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+
+
+def _profile_path(profile_id: str) -> str:
+    return os.path.join(PROFILE_DIR, f"{profile_id}.prof")
+
+
+def _profile_record_path(profile_id: str) -> str:
+    return os.path.join(PROFILE_DIR, f"{profile_id}.json")
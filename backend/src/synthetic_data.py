@@ -0,0 +1,101 @@
+from typing import List
+from typing import Tuple
+from xml.etree.ElementTree import Element
+from xml.etree.ElementTree import SubElement
+
+import argparse
+import random
+import xml.etree.ElementTree as ET
+
+
+# Frequency names as they appear in the Orphadata HPO frequency tags.
+FREQUENCIES: List[Tuple[str, float]] = [
+    ("Obligate (100%)", 0.05),
+    ("Very frequent (99-80%)", 0.25),
+    ("Frequent (79-30%)", 0.35),
+    ("Occasional (29-5%)", 0.3),
+    ("Very rare (<4-1%)", 0.04),
+    ("Excluded (0%)", 0.01),
+]
+
+
+def generate_disorder_symptoms_xml(
+    output_file_path: str,
+    num_disorders: int,
+    num_symptoms: int,
+    max_symptoms_per_disorder: int,
+    seed: int,
+):
+    """
+    Write a synthetic dataset in the same shape as en_product4.xml, so that
+    the backend can be started without the real Orphadata file.
+
+    Symptom popularity is skewed so that a few symptoms occur in many
+    disorders, similar to the real dataset.
+    """
+    rng: random.Random = random.Random(seed)
+    symptom_names: List[str] = [f"Synthetic symptom {i}" for i in range(num_symptoms)]
+    symptom_weights: List[float] = [1.0 / (i + 1) for i in range(num_symptoms)]
+    frequency_names: List[str] = [x[0] for x in FREQUENCIES]
+    frequency_weights: List[float] = [x[1] for x in FREQUENCIES]
+
+    root: Element = Element("JDBOR")
+    disorder_set_list: Element = SubElement(root, "HPODisorderSetStatusList")
+    disorder_set_list.set("count", str(num_disorders))
+    for disorder_index in range(num_disorders):
+        disorder_set: Element = SubElement(disorder_set_list, "HPODisorderSetStatus")
+        disorder: Element = SubElement(disorder_set, "Disorder")
+        disorder.set("id", str(disorder_index))
+        SubElement(disorder, "ExpertLink").text = (
+            f"http://www.orpha.net/synthetic/{disorder_index}"
+        )
+        SubElement(disorder, "Name").text = f"Synthetic disorder {disorder_index}"
+        SubElement(SubElement(disorder, "DisorderType"), "Name").text = "Disease"
+
+        num_disorder_symptoms: int = rng.randint(
+            1, min(max_symptoms_per_disorder, num_symptoms)
+        )
+        disorder_symptom_indices: List[int] = list(
+            set(
+                rng.choices(
+                    range(num_symptoms), weights=symptom_weights, k=num_disorder_symptoms
+                )
+            )
+        )
+        association_list: Element = SubElement(disorder, "HPODisorderAssociationList")
+        association_list.set("count", str(len(disorder_symptom_indices)))
+        for association_index, symptom_index in enumerate(disorder_symptom_indices):
+            association: Element = SubElement(association_list, "HPODisorderAssociation")
+            association.set("id", str(disorder_index * num_symptoms + association_index))
+            hpo: Element = SubElement(association, "HPO")
+            hpo.set("id", str(symptom_index))
+            SubElement(hpo, "HPOId").text = f"HP:{symptom_index:07d}"
+            SubElement(hpo, "HPOTerm").text = symptom_names[symptom_index]
+            SubElement(SubElement(association, "HPOFrequency"), "Name").text = (
+                rng.choices(frequency_names, weights=frequency_weights)[0]
+            )
+
+    ET.ElementTree(root).write(output_file_path, encoding="utf-8", xml_declaration=True)
+    print(
+        f"Wrote '{num_disorders}' synthetic disorders with '{num_symptoms}' "
+        f"symptoms to: '{output_file_path}'"
+    )
+
+
+if __name__ == "__main__":
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description="Generate a synthetic disorder/symptom XML dataset."
+    )
+    parser.add_argument("output_file_path")
+    parser.add_argument("--num-disorders", type=int, default=4000)
+    parser.add_argument("--num-symptoms", type=int, default=8000)
+    parser.add_argument("--max-symptoms-per-disorder", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    args: argparse.Namespace = parser.parse_args()
+    generate_disorder_symptoms_xml(
+        args.output_file_path,
+        args.num_disorders,
+        args.num_symptoms,
+        args.max_symptoms_per_disorder,
+        args.seed,
+    )
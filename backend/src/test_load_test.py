@@ -0,0 +1,100 @@
+from load_test import DISORDER_CANDIDATES_ENDPOINT
+from load_test import SYMPTOM_NAMES_ENDPOINT
+from load_test import LoadTestReport
+from load_test import RequestResult
+from load_test import ResourceSample
+from load_test import build_report
+from load_test import percentiles_ms
+
+
+def _result(end_offset_s: float, latency_ms: float, status: int = 200) -> RequestResult:
+    return RequestResult(
+        endpoint=DISORDER_CANDIDATES_ENDPOINT,
+        end_offset_s=end_offset_s,
+        latency_ms=latency_ms,
+        status=status,
+    )
+
+
+def _sample(start_offset_s: float, end_offset_s: float, cpu_percent: float):
+    return ResourceSample(
+        start_offset_s=start_offset_s,
+        end_offset_s=end_offset_s,
+        cpu_percent=cpu_percent,
+        rss_mb=100.0,
+        num_processes=1,
+    )
+
+
+def test_percentiles_ms_empty():
+    assert percentiles_ms([]) == {}
+
+
+def test_percentiles_ms_single_value():
+    assert percentiles_ms([7.0]) == {"p50": 7.0, "p90": 7.0, "p99": 7.0, "max": 7.0}
+
+
+def test_percentiles_ms_nearest_rank():
+    # Nearest rank of p on n values is the ceil(p / 100 * n)-th smallest value.
+    latencies_ms = [float(x) for x in range(100, 0, -1)]
+    assert percentiles_ms(latencies_ms) == {
+        "p50": 50.0,
+        "p90": 90.0,
+        "p99": 99.0,
+        "max": 100.0,
+    }
+    assert percentiles_ms([1.0, 2.0, 3.0])["p50"] == 2.0
+
+
+def test_build_report_empty():
+    report: LoadTestReport = build_report("dev", 1, 0.0, 0.0, [], 0, [], 1.0)
+    assert report.totalRequests == 0
+    assert report.throughputRps == 0.0
+    assert report.errorRate == 0.0
+    assert report.latencyMs["all"] == {}
+    assert report.intervals == []
+
+
+def test_build_report_errors_excluded_from_latency():
+    results = [
+        _result(0.1, 10.0),
+        _result(0.2, 1000.0, status=503),
+        RequestResult(
+            endpoint=SYMPTOM_NAMES_ENDPOINT,
+            end_offset_s=0.3,
+            latency_ms=5000.0,
+            status=0,
+            error="URLError: refused",
+        ),
+    ]
+    report: LoadTestReport = build_report("dev", 1, 0.0, 1.0, results, 2, [], 1.0)
+    assert report.statusCounts == {"200": 1, "503": 1, "error": 1}
+    assert report.errorRate == round(2 / 3, 4)
+    assert report.droppedRequests == 2
+    assert report.latencyMs["all"]["max"] == 10.0
+    assert report.latencyMs[SYMPTOM_NAMES_ENDPOINT] == {}
+
+
+def test_build_report_interval_bucketing():
+    results = [_result(0.0, 1.0), _result(0.99, 2.0), _result(1.0, 3.0), _result(2.5, 4.0)]
+    samples = [
+        _sample(0.0, 1.01, 10.0),
+        _sample(1.01, 2.0, 20.0),
+        # Final partial sample taken when the sampler stops.
+        _sample(2.0, 2.6, 30.0),
+    ]
+    report: LoadTestReport = build_report("dev", 1, 0.0, 2.6, results, 0, samples, 1.0)
+    assert [x.offsetS for x in report.intervals] == [0.0, 1.0, 2.0]
+    assert [x.requests for x in report.intervals] == [2, 1, 1]
+    assert [x.cpuPercent for x in report.intervals] == [10.0, 20.0, 30.0]
+    assert report.intervals[0].latencyMs["max"] == 2.0
+
+
+def test_build_report_interval_without_samples():
+    report: LoadTestReport = build_report(
+        "external", 1, 0.0, 2.0, [_result(1.5, 1.0)], 0, [], 1.0
+    )
+    assert [x.requests for x in report.intervals] == [0, 1]
+    assert report.intervals[0].latencyMs == {}
+    assert report.intervals[0].cpuPercent is None
+    assert report.intervals[0].rssMb is None
@@ -0,0 +1,172 @@
+from analysis import Disorder
+from analysis import Symptom
+from profiling import ProfileSession
+from profiling import StageTimer
+from typing import List
+
+import analysis
+import backend
+import cProfile
+import importlib
+import json
+import os
+import profiling
+import pytest
+
+
+ADMIN_TOKEN: str = "secret"
+
+
+@pytest.fixture(autouse=True)
+def profile_dir(monkeypatch, tmp_path) -> str:
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    return str(tmp_path)
+
+
+def _session() -> ProfileSession:
+    profiler: cProfile.Profile = cProfile.Profile()
+    profiler.enable()
+    sum(range(10))
+    profiler.disable()
+    return ProfileSession(profiler=profiler, peak_requests_in_flight=1)
+
+
+def _client(monkeypatch, admin_token):
+    if admin_token is None:
+        monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    else:
+        monkeypatch.setenv("ADMIN_TOKEN", admin_token)
+    # The admin routes are registered when the module is imported.
+    importlib.reload(backend)
+    symptom: Symptom = Symptom("Frequent", (0.3, 0.79), 1, "Seizure")
+    disorder: Disorder = Disorder(
+        "link", 1, "Disorder", [symptom], {"seizure": symptom}, "Disease"
+    )
+    backend.app_state.disorders = [disorder]
+    backend.app_state.symptom_name_to_metadata = analysis.compute_symptom_metadata(
+        [disorder]
+    )
+    return backend.app.test_client()
+
+
+def test_store_profile_evicts_oldest(monkeypatch, profile_dir):
+    monkeypatch.setattr(profiling, "PROFILE_RING_BUFFER_SIZE", 3)
+    profile_ids: List[str] = [profiling.new_profile_id() for _ in range(5)]
+    for i, profile_id in enumerate(profile_ids):
+        profiling.store_profile(_session(), profile_id, ["seizure"], 1.0)
+        # Make sure modification times are strictly increasing.
+        os.utime(os.path.join(profile_dir, f"{profile_id}.prof"), (i, i))
+
+    assert [x.id for x in profiling.get_profiles()] == profile_ids[:1:-1]
+    assert sorted(os.listdir(profile_dir)) == sorted(
+        [f"{x}.prof" for x in profile_ids[2:]] + [f"{x}.json" for x in profile_ids[2:]]
+    )
+    assert profiling.get_profile_summary(profile_ids[0]) is None
+    assert "function calls" in profiling.get_profile_summary(profile_ids[-1])
+
+
+@pytest.mark.parametrize(
+    "profile_id", ["../x", "../profiles/" + "a" * 32, "A" * 32, "a" * 31, ""]
+)
+def test_get_profile_summary_rejects_invalid_ids(profile_id):
+    assert profiling.get_profile_summary(profile_id) is None
+
+
+def test_get_profile_summary_truncated_profile(profile_dir):
+    profile_id: str = profiling.new_profile_id()
+    with open(os.path.join(profile_dir, f"{profile_id}.prof"), "wb") as profile_file:
+        profile_file.write(b"\x00")
+    assert profiling.get_profile_summary(profile_id) is None
+
+
+def test_record_if_slow_threshold(monkeypatch):
+    monkeypatch.setattr(profiling, "SLOW_QUERY_THRESHOLD_MS", 100.0)
+    timer: StageTimer = StageTimer()
+    assert profiling.record_if_slow(["fast"], 1, timer, 99.9, None) is None
+    assert profiling.record_if_slow(["slow"], 2, timer, 100.0, "id") is not None
+    slow_queries = profiling.get_slow_queries()
+    assert [x.symptoms for x in slow_queries] == [["slow"]]
+    assert slow_queries[0].numCandidates == 2
+    assert slow_queries[0].profileId == "id"
+
+
+def test_record_if_slow_rotation(monkeypatch, profile_dir):
+    monkeypatch.setattr(profiling, "SLOW_QUERY_THRESHOLD_MS", 0.0)
+    monkeypatch.setattr(profiling, "SLOW_QUERY_LOG_MAX_BYTES", 500)
+    monkeypatch.setattr(profiling, "SLOW_QUERY_RING_BUFFER_SIZE", 3)
+    # Each entry is over 100 bytes, so the log rotates every few entries.
+    for i in range(21):
+        profiling.record_if_slow([f"symptom {i}"], i, StageTimer(), 1.0, None)
+
+    log_path: str = os.path.join(profile_dir, profiling.SLOW_QUERY_LOG_FILE_NAME)
+    assert os.path.getsize(log_path + ".1") > 500
+    assert os.path.getsize(log_path) <= 500
+    with open(log_path + ".1") as previous_log_file:
+        assert all(json.loads(line) for line in previous_log_file)
+    # The newest entries are read across the previous and the current file.
+    assert [x.numCandidates for x in profiling.get_slow_queries()] == [20, 19, 18]
+
+
+def test_admin_routes_not_registered_without_token(monkeypatch):
+    client = _client(monkeypatch, None)
+    assert client.get("/admin/slowQueries").status_code == 404
+    response = client.post(
+        "/disorderCandidates",
+        json={"symptoms": ["Seizure"]},
+        headers={profiling.PROFILE_HEADER: "1"},
+    )
+    assert response.status_code == 200
+    assert profiling.PROFILE_ID_HEADER not in response.headers
+
+
+def test_admin_routes_require_token(monkeypatch):
+    client = _client(monkeypatch, ADMIN_TOKEN)
+    assert client.get("/admin/slowQueries").status_code == 403
+    assert (
+        client.get(
+            "/admin/slowQueries", headers={backend.ADMIN_TOKEN_HEADER: "wrong"}
+        ).status_code
+        == 403
+    )
+    response = client.get(
+        "/admin/slowQueries",
+        headers={backend.ADMIN_TOKEN_HEADER: ADMIN_TOKEN, "Origin": "http://evil.example"},
+    )
+    assert response.status_code == 200
+    assert "Access-Control-Allow-Origin" not in response.headers
+
+
+def test_profile_request_with_token(monkeypatch):
+    monkeypatch.setattr(profiling, "SLOW_QUERY_THRESHOLD_MS", 0.0)
+    client = _client(monkeypatch, ADMIN_TOKEN)
+    admin_headers = {backend.ADMIN_TOKEN_HEADER: ADMIN_TOKEN}
+
+    # The profile header is ignored without the admin token.
+    with client.post(
+        "/disorderCandidates",
+        json={"symptoms": ["Seizure"]},
+        headers={profiling.PROFILE_HEADER: "1"},
+    ) as response:
+        assert profiling.PROFILE_ID_HEADER not in response.headers
+
+    with client.post(
+        "/disorderCandidates",
+        json={"symptoms": ["Seizure"]},
+        headers={profiling.PROFILE_HEADER: "1", **admin_headers},
+    ) as response:
+        profile_id: str = response.headers[profiling.PROFILE_ID_HEADER]
+
+    profiles = client.get("/admin/profiles", headers=admin_headers).json["profiles"]
+    assert [x["id"] for x in profiles] == [profile_id]
+    assert profiles[0]["otherRequestsInFlight"] == 0
+    response = client.get(f"/admin/profiles/{profile_id}", headers=admin_headers)
+    assert response.status_code == 200
+    assert b"function calls" in response.data
+    assert (
+        client.get("/admin/profiles/" + "0" * 32, headers=admin_headers).status_code
+        == 404
+    )
+    slow_queries = client.get("/admin/slowQueries", headers=admin_headers).json[
+        "slowQueries"
+    ]
+    assert [x["profileId"] for x in slow_queries] == [profile_id, None]